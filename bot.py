@@ -1,232 +1,780 @@
+import io
 import os
-import re
+import csv
+import contextlib
+import functools
+import atexit
+import asyncio
+import hashlib
+import importlib.util
+import json
 import logging
 import tempfile
-import requests
+import zipfile
+import time
+import httpx
+from collections import deque
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Optional
-import pandas as pd
+from cachetools import LRUCache, TTLCache
 from pathlib import Path
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape as xml_escape
 from telegram import Update, Document
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, TypeHandler, SimpleUpdateProcessor, filters, ContextTypes
+)
 
 # Setup logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+try:
+    import orjson
+    
+    def _json_dumps(payload: dict) -> str:
+        return orjson.dumps(payload, default=str).decode()
+    
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_dumps(payload: dict) -> str:
+        return json.dumps(payload, ensure_ascii=False, default=str)
+    
+    _json_loads = json.loads
+
+# Atribut bawaan LogRecord; sisanya dianggap field `extra=` dan ikut di-serialize
+_LOG_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonLogFormatter(logging.Formatter):
+    """Formatter satu baris JSON per log record (LOG_FORMAT=json)"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        payload.update((k, v) for k, v in vars(record).items() if k not in _LOG_RECORD_ATTRS)
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return _json_dumps(payload)
+
+if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(JsonLogFormatter())
+    logging.basicConfig(handlers=[_log_handler], level=logging.INFO)
+else:
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
 logger = logging.getLogger(__name__)
 
 # Konfigurasi
 PDF_SERVICE_URL = os.getenv('PDF_SERVICE_URL', 'http://markdown-pdf-service:8080/convert')
 DATA_DIR = os.getenv('DATA_DIR', './data')
-EXCEL_LOG_FILE = os.path.join(DATA_DIR, 'user_generations.xlsx')
+LOG_CSV_FILE = os.path.join(DATA_DIR, 'user_generations.csv')
+EXCEL_LOG_FILE = os.path.join(DATA_DIR, 'user_generations.xlsx')  # format lama, dimigrasi ke CSV
 BACKUP_DIR = os.path.join(DATA_DIR, 'backups')
+BACKUP_MARKER_FILE = os.path.join(BACKUP_DIR, '.last')  # epoch backup terakhir
+LOG_STATS_FILE = os.path.join(DATA_DIR, 'stats.json')  # snapshot statistik log
+LOG_CSV_ABS = os.path.abspath(LOG_CSV_FILE)  # untuk log/pesan, dihitung sekali
+BACKUP_DIR_ABS = os.path.abspath(BACKUP_DIR)
 FREE_DAILY_QUOTA = int(os.getenv('FREE_DAILY_QUOTA', '15'))
 HOURLY_RATE_LIMIT = int(os.getenv('HOURLY_RATE_LIMIT', '3'))
 AUTO_BACKUP_ENABLED = os.getenv('AUTO_BACKUP_ENABLED', 'true').lower() == 'true'
 BACKUP_INTERVAL_HOURS = int(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+PDF_CONCURRENCY = int(os.getenv('PDF_CONCURRENCY', '4'))
+PDF_CACHE_MAX_MB = int(os.getenv('PDF_CACHE_MAX_MB', '32'))
+URL_CACHE_MAX_MB = int(os.getenv('URL_CACHE_MAX_MB', '8'))
+PDF_FILE_ID_TTL_HOURS = int(os.getenv('PDF_FILE_ID_TTL_HOURS', '24'))
+MAX_PDF_MB = int(os.getenv('MAX_PDF_MB', '50'))  # batas upload dokumen Bot API
+MAX_PDF_BYTES = MAX_PDF_MB * 1024 * 1024
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))  # update yang diproses bersamaan
+HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', '32'))
+HTTP_CONNECT_RETRIES = int(os.getenv('HTTP_CONNECT_RETRIES', '2'))
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '256'))  # koneksi ke Bot API (selain getUpdates)
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '30'))  # long-poll getUpdates (detik)
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '0'))  # jeda setelah tiap respons getUpdates
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', 'false').lower() == 'true'
+PUBLIC_URL = os.getenv('PUBLIC_URL', '').rstrip('/')  # jika diisi, bot pakai webhook
+WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+ADMIN_IDS = frozenset(int(x) for x in os.getenv('ADMIN_USER_IDS', '896847229').split(',') if x.strip())
+ACK_DEBOUNCE_SECONDS = float(os.getenv('ACK_DEBOUNCE_SECONDS', '1.5'))
+SESSION_TTL_SECONDS = int(os.getenv('SESSION_TTL_SECONDS', '3600'))
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '10000'))
+MAX_MARKDOWN_MB = int(os.getenv('MAX_MARKDOWN_MB', '10'))  # batas total markdown per sesi
+SPOOL_MAX_KB = int(os.getenv('SPOOL_MAX_KB', '256'))  # di atas ini buffer dipindah ke disk
+
+MAX_MARKDOWN_BYTES = MAX_MARKDOWN_MB * 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+
+PREVIEW_LENGTH = 150
+
+@dataclass(slots=True)
+class UserSession:
+    """Sesi user: buffer markdown (UTF-8), statistik per input, dan tipe input terakhir"""
+    buffer: tempfile.SpooledTemporaryFile = field(
+        default_factory=lambda: tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_KB * 1024, mode='w+b'),
+        repr=False
+    )
+    digest: 'hashlib.blake2b' = field(default_factory=lambda: hashlib.blake2b(digest_size=16), repr=False)
+    count: int = 0
+    total_bytes: int = 0
+    total_chars: int = 0
+    total_lines: int = 0
+    first_preview: str = ''
+    msg_type: str = 'unknown'
+    ack_task: Optional[asyncio.Task] = field(default=None, repr=False)
+    
+    def append(self, text: str) -> bool:
+        """
+        Tambah potongan markdown (dipisah baris kosong) dan update statistik
+        Returns: False jika total markdown melebihi MAX_MARKDOWN_BYTES (tidak ditulis)
+        """
+        data = text.encode('utf-8')
+        if self.count:
+            data = b"\n\n" + data
+        if self.total_bytes + len(data) > MAX_MARKDOWN_BYTES:
+            return False
+        
+        if not self.count:
+            self.first_preview = (text[:PREVIEW_LENGTH] + "...") if len(text) > PREVIEW_LENGTH else text
+        # Selalu tulis di akhir file (posisi bisa berubah saat buffer sedang di-stream)
+        self.buffer.seek(0, io.SEEK_END)
+        self.buffer.write(data)
+        self.digest.update(data)
+        self.total_bytes += len(data)
+        self.count += 1
+        self.total_chars += len(text)
+        self.total_lines += text.count('\n') + 1
+        return True
+    
+    def joined_length(self) -> int:
+        """Jumlah karakter markdown gabungan termasuk pemisah baris kosong (kolom input_length)"""
+        return self.total_chars + 2 * max(self.count - 1, 0)
+    
+    def cache_key(self) -> str:
+        """Hash konten markdown untuk key cache PDF (dihitung incremental tiap append)"""
+        return self.digest.hexdigest()
+    
+    async def iter_bytes(self, length: int):
+        """Stream `length` byte pertama buffer per chunk tanpa menggabungkan semuanya di memory"""
+        offset = 0
+        while offset < length:
+            self.buffer.seek(offset)
+            chunk = self.buffer.read(min(STREAM_CHUNK_SIZE, length - offset))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+HOURLY_WINDOW_SECONDS = 3600
+
+def next_daily_reset_ts() -> float:
+    """Waktu reset harian berikutnya (tengah malam) dalam detik time.monotonic()"""
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return time.monotonic() + (midnight - now).total_seconds()
+
+def next_hourly_reset_ts() -> float:
+    """Waktu reset per jam berikutnya dalam detik time.monotonic()"""
+    return time.monotonic() + HOURLY_WINDOW_SECONDS
+
+@dataclass(slots=True)
+class UserQuota:
+    """Counter quota user (disimpan terpisah dari sesi agar tidak ikut expire)"""
+    daily_count: int = 0
+    hourly_count: int = 0
+    next_daily_reset: float = field(default_factory=next_daily_reset_ts)
+    next_hourly_reset: float = field(default_factory=next_hourly_reset_ts)
+    is_premium: bool = False
+
+class SessionCache(TTLCache):
+    """TTLCache untuk sesi user yang mencatat sesi yang dibuang"""
+    
+    def expire(self, time=None):
+        expired = super().expire(time)
+        for user_id, buf in expired:
+            logger.info("🧹 Session expired for user %s (%d input ditinggalkan)", user_id, buf.count)
+        return expired
+    
+    def popitem(self):
+        user_id, buf = super().popitem()
+        logger.warning("🧹 Session evicted for user %s (max %d sesi tercapai)", user_id, self.maxsize)
+        return user_id, buf
 
 # User states
-user_states = {}
-user_markdown = {}
-message_types = {}
-user_quota = {}  # {user_id: {'daily_count': int, 'hourly_count': int, 'last_reset': datetime, 'hourly_reset': datetime, 'is_premium': bool}}
+# Sesi aktif (sudah /start dan menunggu input): {user_id: UserSession}
+# TTL diperpanjang setiap kali user mengirim input baru
+user_sessions = SessionCache(maxsize=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS)
+user_quota: dict[int, UserQuota] = {}
+
+# Batasi jumlah konversi yang dikirim bersamaan ke PDF service
+pdf_semaphore = asyncio.Semaphore(PDF_CONCURRENCY)
+
+# Cache PDF hasil render: {hash markdown: pdf bytes}, dibatasi total ukuran bytes
+pdf_cache = LRUCache(maxsize=PDF_CACHE_MAX_MB * 1024 * 1024, getsizeof=len)
+
+# file_id dari PDF yang sudah pernah di-upload ke Telegram: {hash markdown: file_id}
+pdf_file_ids = TTLCache(maxsize=1024, ttl=PDF_FILE_ID_TTL_HOURS * 3600)
+
+# Markdown dari URL yang punya validator: {url: (etag, last_modified, text)}
+url_cache = LRUCache(maxsize=URL_CACHE_MAX_MB * 1024 * 1024, getsizeof=lambda entry: len(entry[2]))
 
 # ==================== EXCEL LOGGING ====================
 
+LOG_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_COLUMNS = (
+    'timestamp', 'user_id', 'username', 'first_name', 'last_name',
+    'input_type', 'input_length', 'success', 'error_message', 'is_premium'
+)
+
+LOG_BATCH_SIZE = 64
+LOG_FLUSH_SECONDS = float(os.getenv('LOG_FLUSH_SECONDS', '10'))  # jeda maksimal sebelum batch ditulis
+
+@dataclass(slots=True)
+class LogStats:
+    """Statistik log generasi yang diupdate setiap batch ditulis (tanpa membaca ulang file)"""
+    total_records: int = 0
+    successful: int = 0
+    users: set = field(default_factory=set)
+    premium_users: set = field(default_factory=set)
+    
+    def add(self, user_id: int, success: bool, is_premium: bool):
+        self.total_records += 1
+        self.successful += success
+        self.users.add(user_id)
+        if is_premium:
+            self.premium_users.add(user_id)
+    
+    def as_dict(self) -> dict:
+        return {
+            'total_records': self.total_records,
+            'total_users': len(self.users),
+            'successful_conversions': self.successful,
+            'failed_conversions': self.total_records - self.successful,
+            'premium_users': len(self.premium_users),
+        }
+
+_LOG_USER_ID = LOG_COLUMNS.index('user_id')
+_LOG_SUCCESS = LOG_COLUMNS.index('success')
+_LOG_IS_PREMIUM = LOG_COLUMNS.index('is_premium')
+
+log_stats = LogStats()
+_log_stats_valid = False  # True setelah log_stats dimuat/di-scan dari CSV; snapshot hanya disimpan jika True
+
+# Jadwal backup otomatis: cek paling sering sekali per BACKUP_CHECK_INTERVAL_SECONDS
+BACKUP_CHECK_INTERVAL_SECONDS = 60
+_last_backup_check = 0.0
+_last_backup_ts: Optional[float] = None
+
+# Baris log diantrikan oleh handler lalu ditulis per batch oleh log_worker
+log_queue: asyncio.Queue = asyncio.Queue()
+_log_worker_task: Optional[asyncio.Task] = None
+# Handle CSV yang tetap terbuka selama bot jalan (dibuka saat batch pertama)
+_log_fh = None
+_log_writer = None
+
+try:
+    import python_calamine  # noqa: F401 - parser xlsx berbasis Rust, jauh lebih cepat dari openpyxl
+    EXCEL_READ_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_READ_ENGINE = 'openpyxl'
+
+def _load_log_stats() -> Optional[LogStats]:
+    """Muat snapshot statistik; hanya valid jika ukuran CSV sama dengan saat snapshot dibuat"""
+    try:
+        data = json.loads(Path(LOG_STATS_FILE).read_text())
+        if data['file_size'] != os.path.getsize(LOG_CSV_FILE):
+            return None
+        return LogStats(
+            total_records=data['total_records'],
+            successful=data['successful'],
+            users=set(data['users']),
+            premium_users=set(data['premium_users'])
+        )
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _scan_log_stats() -> LogStats:
+    """Hitung ulang statistik dengan satu kali baca CSV"""
+    stats = LogStats()
+    skipped = 0
+    with open(LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        for row in reader:
+            try:
+                stats.add(int(row[_LOG_USER_ID]), row[_LOG_SUCCESS] == 'True', row[_LOG_IS_PREMIUM] == 'True')
+            except (IndexError, ValueError):
+                skipped += 1  # baris terpotong (crash saat menulis) atau diedit manual
+    if skipped:
+        logger.warning("⚠️ Skipped %d malformed log row(s) while rebuilding stats", skipped)
+    return stats
+
+def save_log_stats():
+    """Simpan snapshot statistik + ukuran CSV saat ini (dipanggil saat shutdown)"""
+    if not _log_stats_valid:
+        # Statistik tidak dibangun dari CSV; biarkan startup berikutnya scan ulang
+        return
+    try:
+        Path(LOG_STATS_FILE).write_text(json.dumps({
+            'file_size': os.path.getsize(LOG_CSV_FILE),
+            'total_records': log_stats.total_records,
+            'successful': log_stats.successful,
+            'users': list(log_stats.users),
+            'premium_users': list(log_stats.premium_users),
+        }))
+    except OSError as e:
+        logger.error("❌ Error saving log stats: %s", e)
+
 def init_excel_log():
-    """Inisialisasi file Excel untuk logging"""
+    """Inisialisasi file log generasi (CSV append-only, xlsx hanya dibuat saat dibutuhkan)"""
+    global log_stats, _log_stats_valid
     # Buat directory jika belum ada
     Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
     Path(BACKUP_DIR).mkdir(parents=True, exist_ok=True)
     
-    if not Path(EXCEL_LOG_FILE).exists():
-        df = pd.DataFrame(columns=[
-            'timestamp', 'user_id', 'username', 'first_name', 'last_name',
-            'input_type', 'input_length', 'success', 'error_message', 'is_premium'
-        ])
-        df.to_excel(EXCEL_LOG_FILE, index=False)
-        logger.info(f"✅ Excel log file created: {os.path.abspath(EXCEL_LOG_FILE)}")
+    if not Path(LOG_CSV_FILE).exists():
+        if Path(EXCEL_LOG_FILE).exists():
+            # Migrasi log Excel lama ke CSV
+            import pandas as pd  # import berat, hanya saat dibutuhkan
+            pd.read_excel(
+                EXCEL_LOG_FILE,
+                engine=EXCEL_READ_ENGINE,
+                dtype={'user_id': 'int64', 'success': 'bool', 'is_premium': 'bool'},
+                parse_dates=['timestamp']
+            ).to_csv(
+                LOG_CSV_FILE, index=False, columns=list(LOG_COLUMNS), date_format=LOG_TIMESTAMP_FORMAT
+            )
+            logger.info("🔁 Excel log migrated to CSV: %s", LOG_CSV_ABS)
+        else:
+            with open(LOG_CSV_FILE, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(LOG_COLUMNS)
+            logger.info("✅ Log file created: %s", LOG_CSV_ABS)
     else:
-        logger.info(f"📊 Excel log file exists: {os.path.abspath(EXCEL_LOG_FILE)}")
+        logger.info("📊 Log file exists: %s", LOG_CSV_ABS)
+    
+    # Snapshot dipakai jika masih cocok, selain itu scan ulang CSV sekali
+    log_stats = _load_log_stats() or _scan_log_stats()
+    _log_stats_valid = True
 
 def log_generation(user_id: int, username: str, first_name: str, last_name: str,
                    input_type: str, input_length: int, success: bool, 
                    error_message: str = '', is_premium: bool = False):
-    """Log generasi PDF ke Excel"""
+    """Antrikan log generasi PDF (ditulis ke CSV oleh log_worker)"""
+    # Urutan harus sama dengan LOG_COLUMNS
+    log_queue.put_nowait((
+        datetime.now().strftime(LOG_TIMESTAMP_FORMAT),
+        user_id,
+        username or '',
+        first_name or '',
+        last_name or '',
+        input_type,
+        input_length,
+        success,
+        error_message,
+        is_premium
+    ))
+
+def _flush_log_batch(rows: list[tuple]):
+    """Tulis batch baris log ke CSV sekaligus (dijalankan di thread)"""
+    global _log_fh, _log_writer
     try:
-        df = pd.read_excel(EXCEL_LOG_FILE)
-        new_row = {
-            'timestamp': datetime.now(),
-            'user_id': user_id,
-            'username': username or '',
-            'first_name': first_name or '',
-            'last_name': last_name or '',
-            'input_type': input_type,
-            'input_length': input_length,
-            'success': success,
-            'error_message': error_message,
-            'is_premium': is_premium
-        }
-        df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-        df.to_excel(EXCEL_LOG_FILE, index=False)
-        
-        total_records = len(df)
-        logger.info(f"✅ Logged generation for user {user_id} (Total records: {total_records})")
-        
-        # Auto backup jika enabled
-        if AUTO_BACKUP_ENABLED:
-            check_and_backup()
-            
+        if _log_fh is None:
+            _log_fh = open(LOG_CSV_FILE, 'a', newline='', encoding='utf-8', buffering=1 << 16)
+            _log_writer = csv.writer(_log_fh)
+        _log_writer.writerows(rows)
+        # Flush per batch supaya export/stats selalu melihat baris terbaru
+        _log_fh.flush()
+    except Exception as e:
+        logger.error("❌ Error logging generation, %d row(s) dropped: %s", len(rows), e)
+        # Tutup handle (sisa buffer ikut tertulis sekarang, bukan saat GC) lalu buka ulang pada batch berikutnya
+        if _log_fh is not None:
+            with contextlib.suppress(Exception):
+                _log_fh.close()
+        _log_fh = _log_writer = None
+        return
+    
+    for row in rows:
+        log_stats.add(row[_LOG_USER_ID], row[_LOG_SUCCESS], row[_LOG_IS_PREMIUM])
+    
+    logger.info("✅ Logged %d generation(s) (Total records: %d)", len(rows), log_stats.total_records)
+    
+    # Auto backup jika enabled (error backup ditangani di backup_excel)
+    if AUTO_BACKUP_ENABLED:
+        check_and_backup()
+
+async def log_worker():
+    """Konsumen log_queue: kumpulkan baris yang tertunda lalu tulis per batch"""
+    # Init file log di background; log yang masuk selama init menunggu di antrian
+    try:
+        await asyncio.to_thread(init_excel_log)
     except Exception as e:
-        logger.error(f"❌ Error logging to Excel: {e}")
+        logger.error("❌ Error initializing log file: %s", e)
+    
+    loop = asyncio.get_running_loop()
+    running = True
+    while running:
+        batch = [await log_queue.get()]
+        # Kumpulkan baris sampai batch penuh atau LOG_FLUSH_SECONDS lewat
+        deadline = loop.time() + LOG_FLUSH_SECONDS
+        while batch[-1] is not None and len(batch) < LOG_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(log_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        if batch[-1] is None:
+            # Sinyal berhenti dari post_stop
+            running = False
+            batch.pop()
+        if batch:
+            await asyncio.to_thread(_flush_log_batch, batch)
+
+def drain_log_queue():
+    """Tulis semua log yang masih di antrian (dipakai saat shutdown)"""
+    batch = []
+    while not log_queue.empty():
+        row = log_queue.get_nowait()
+        if row is not None:
+            batch.append(row)
+    if batch:
+        _flush_log_batch(batch)
+
+def close_log_file():
+    """Tutup handle CSV log dan simpan snapshot statistik (dipanggil saat shutdown)"""
+    global _log_fh, _log_writer
+    if _log_fh is not None:
+        _log_fh.close()
+        _log_fh = _log_writer = None
+        save_log_stats()
+
+@atexit.register
+def _flush_log_on_exit():
+    """Jaring pengaman jika proses keluar tanpa melewati post_stop (misal crash saat startup)"""
+    drain_log_queue()
+    close_log_file()
+
+# Karakter yang tidak valid di XML 1.0 (kontrol selain tab/LF/CR, U+FFFE/U+FFFF); dibuang dari
+# semua sel sebelum export karena writer xlsx mana pun tidak bisa menyimpannya
+_XML_ILLEGAL_TABLE = dict.fromkeys([*(c for c in range(0x20) if c not in (0x09, 0x0A, 0x0D)), 0xFFFE, 0xFFFF])
+
+def _typed_log_row(row: list[str]) -> tuple:
+    """Kembalikan tipe asli kolom log (datetime, int, bool); sel kosong jadi None"""
+    try:
+        (timestamp, user_id, username, first_name, last_name,
+         input_type, input_length, success, error_message, is_premium) = row
+        return (
+            datetime.fromisoformat(timestamp), int(user_id),
+            username or None, first_name or None, last_name or None,
+            input_type, int(input_length), success == 'True',
+            error_message or None, is_premium == 'True'
+        )
+    except ValueError:
+        # Baris rusak tetap diekspor apa adanya
+        return tuple(row)
+
+def iter_log_rows():
+    """Stream baris log dari CSV (tanpa header) dengan tipe aslinya, sudah bersih untuk xlsx"""
+    with open(LOG_CSV_FILE, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            yield _typed_log_row([value.translate(_XML_ILLEGAL_TABLE) for value in row])
+
+def _export_with_pyexcelerate(output_path: str):
+    """Writer xlsx value-only tercepat; semua baris dikumpulkan dulu di memory"""
+    from pyexcelerate import Workbook, Style, Format
+    
+    wb = Workbook()
+    ws = wb.new_sheet('Sheet1', data=[LOG_COLUMNS, *iter_log_rows()])
+    # Satu style per kolom (bukan per sel) supaya timestamp tampil sebagai tanggal
+    ws.set_col_style(LOG_COLUMNS.index('timestamp') + 1, Style(format=Format('yyyy-mm-dd hh:mm:ss')))
+    wb.save(output_path)
+
+def _export_with_openpyxl(output_path: str):
+    """Mode write-only: baris di-stream langsung ke XML, memory tetap kecil berapapun jumlah row"""
+    from openpyxl import Workbook
+    
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    ws.append(LOG_COLUMNS)
+    for row in iter_log_rows():
+        ws.append(row)
+    wb.save(output_path)
+
+# Kerangka OPC minimal untuk xlsx satu sheet (dipakai _export_raw_xlsx)
+_XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Style 1 = format tanggal untuk kolom timestamp
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+_XLSX_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+
+def _xlsx_cell(value) -> str:
+    """Render satu sel sheet1.xml sesuai tipe nilai"""
+    if value is None:
+        return '<c/>'
+    if value is True or value is False:
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, int):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH).total_seconds() / 86400!r}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{xml_escape(str(value))}</t></is></c>'
+
+def _export_raw_xlsx(output_path: str):
+    """
+    Tulis xlsx langsung sebagai XML di dalam zip, tanpa library Excel
+    Dipakai untuk log sangat besar di mana overhead per-sel writer lain dominan
+    """
+    with zipfile.ZipFile(output_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_STATIC_PARTS.items():
+            zf.writestr(name, xml)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as raw, \
+                io.TextIOWrapper(raw, encoding='utf-8', write_through=False) as sheet:
+            sheet.write(_XLSX_SHEET_HEAD)
+            sheet.write('<row>' + ''.join(map(_xlsx_cell, LOG_COLUMNS)) + '</row>')
+            for row in iter_log_rows():
+                sheet.write('<row>' + ''.join(map(_xlsx_cell, row)) + '</row>')
+            sheet.write(_XLSX_SHEET_TAIL)
+
+PYEXCELERATE_AVAILABLE = importlib.util.find_spec('pyexcelerate') is not None
+RAW_XLSX_MIN_ROWS = 50_000
+
+def export_log_to_excel(output_path: str):
+    """Render log CSV menjadi file xlsx (hanya saat backup/admin butuh)"""
+    if log_stats.total_records > RAW_XLSX_MIN_ROWS:
+        _export_raw_xlsx(output_path)
+    elif PYEXCELERATE_AVAILABLE:
+        _export_with_pyexcelerate(output_path)
+    else:
+        _export_with_openpyxl(output_path)
 
 def backup_excel():
-    """Backup file Excel dengan timestamp"""
+    """Backup log sebagai file Excel dengan timestamp"""
     try:
-        if not Path(EXCEL_LOG_FILE).exists():
-            logger.warning("No Excel file to backup")
+        if not Path(LOG_CSV_FILE).exists():
+            logger.warning("No log file to backup")
             return None
         
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_filename = f"user_generations_backup_{timestamp}.xlsx"
         backup_path = os.path.join(BACKUP_DIR, backup_filename)
         
-        # Copy file
-        import shutil
-        shutil.copy2(EXCEL_LOG_FILE, backup_path)
+        export_log_to_excel(backup_path)
+        _mark_backup_done()
         
-        logger.info(f"✅ Backup created: {backup_path}")
+        logger.info("✅ Backup created: %s", backup_path)
         return backup_path
     except Exception as e:
-        logger.error(f"❌ Error creating backup: {e}")
+        logger.error("❌ Error creating backup: %s", e)
         return None
 
+def _mark_backup_done():
+    """Simpan waktu backup terakhir di memory dan sidecar file"""
+    global _last_backup_ts
+    _last_backup_ts = time.time()
+    Path(BACKUP_MARKER_FILE).write_text(str(_last_backup_ts))
+
+def _read_last_backup_ts() -> Optional[float]:
+    """Baca waktu backup terakhir dari sidecar, fallback ke nama file backup terbaru"""
+    try:
+        return float(Path(BACKUP_MARKER_FILE).read_text().strip())
+    except (OSError, ValueError):
+        pass
+    
+    # Nama file berurutan sesuai waktu, jadi cukup ambil yang terbesar
+    latest_backup = max(Path(BACKUP_DIR).glob('user_generations_backup_*.xlsx'), default=None)
+    if latest_backup is None:
+        return None
+    
+    # Format stem tetap: ..._YYYYmmdd_HHMMSS
+    stem = latest_backup.stem
+    return datetime.strptime(stem[-15:-7] + stem[-6:], '%Y%m%d%H%M%S').timestamp()
+
 def check_and_backup():
     """Cek apakah perlu backup otomatis"""
-    backup_files = sorted(Path(BACKUP_DIR).glob('user_generations_backup_*.xlsx'))
+    global _last_backup_check, _last_backup_ts
+    now = time.monotonic()
+    if now - _last_backup_check < BACKUP_CHECK_INTERVAL_SECONDS:
+        return
+    _last_backup_check = now
+    
+    try:
+        if _last_backup_ts is None:
+            _last_backup_ts = _read_last_backup_ts()
+    except Exception as e:
+        logger.error("Error parsing backup time: %s", e)
+        return
     
-    if not backup_files:
+    if _last_backup_ts is None:
         # Belum ada backup, buat backup pertama
         backup_excel()
         return
     
-    # Cek backup terakhir
-    latest_backup = backup_files[-1]
-    backup_time_str = latest_backup.stem.split('_')[-2] + latest_backup.stem.split('_')[-1]
-    
-    try:
-        backup_time = datetime.strptime(backup_time_str, '%Y%m%d%H%M%S')
-        hours_since_backup = (datetime.now() - backup_time).total_seconds() / 3600
-        
-        if hours_since_backup >= BACKUP_INTERVAL_HOURS:
-            logger.info(f"⏰ Last backup was {hours_since_backup:.1f} hours ago, creating new backup...")
-            backup_excel()
-    except Exception as e:
-        logger.error(f"Error parsing backup time: {e}")
+    hours_since_backup = (time.time() - _last_backup_ts) / 3600
+    if hours_since_backup >= BACKUP_INTERVAL_HOURS:
+        logger.info("⏰ Last backup was %.1f hours ago, creating new backup...", hours_since_backup)
+        backup_excel()
 
 def get_excel_stats() -> dict:
-    """Dapatkan statistik dari Excel log"""
+    """Dapatkan statistik dari log generasi (counter in-memory, O(1))"""
     try:
-        if not Path(EXCEL_LOG_FILE).exists():
-            return {
-                'total_records': 0,
-                'total_users': 0,
-                'successful_conversions': 0,
-                'failed_conversions': 0,
-                'premium_users': 0
-            }
-        
-        df = pd.read_excel(EXCEL_LOG_FILE)
-        
         return {
-            'total_records': len(df),
-            'total_users': df['user_id'].nunique(),
-            'successful_conversions': len(df[df['success'] == True]),
-            'failed_conversions': len(df[df['success'] == False]),
-            'premium_users': df[df['is_premium'] == True]['user_id'].nunique(),
-            'file_size_mb': os.path.getsize(EXCEL_LOG_FILE) / (1024 * 1024)
+            **log_stats.as_dict(),
+            'file_size_mb': os.path.getsize(LOG_CSV_FILE) / (1024 * 1024)
         }
     except Exception as e:
-        logger.error(f"Error getting Excel stats: {e}")
+        logger.error("Error getting log stats: %s", e)
         return {}
 
 # ==================== QUOTA & RATE LIMITING ====================
 
-def init_user_quota(user_id: int):
+def init_user_quota(user_id: int) -> UserQuota:
     """Inisialisasi quota user"""
-    if user_id not in user_quota:
-        user_quota[user_id] = {
-            'daily_count': 0,
-            'hourly_count': 0,
-            'last_reset': datetime.now(),
-            'hourly_reset': datetime.now(),
-            'is_premium': False
-        }
+    quota = user_quota.get(user_id)
+    if quota is None:
+        quota = user_quota[user_id] = UserQuota()
+    return quota
 
-def reset_quota_if_needed(user_id: int):
-    """Reset quota jika sudah lewat periode"""
-    init_user_quota(user_id)
-    now = datetime.now()
+def reset_quota_if_needed(user_id: int, now: Optional[float] = None) -> UserQuota:
+    """
+    Reset quota jika sudah lewat periode
+    now: waktu time.monotonic() yang sudah dicatat untuk update ini (opsional)
+    """
+    quota = init_user_quota(user_id)
+    if now is None:
+        now = time.monotonic()
+    
+    # Fast path: belum ada periode yang lewat
+    if now < quota.next_hourly_reset and now < quota.next_daily_reset:
+        return quota
     
     # Reset daily quota (tengah malam)
-    if now.date() > user_quota[user_id]['last_reset'].date():
-        user_quota[user_id]['daily_count'] = 0
-        user_quota[user_id]['last_reset'] = now
-        logger.info(f"Daily quota reset for user {user_id}")
+    if now >= quota.next_daily_reset:
+        quota.daily_count = 0
+        quota.next_daily_reset = next_daily_reset_ts()
+        logger.info("Daily quota reset for user %s", user_id)
     
     # Reset hourly quota
-    if now >= user_quota[user_id]['hourly_reset'] + timedelta(hours=1):
-        user_quota[user_id]['hourly_count'] = 0
-        user_quota[user_id]['hourly_reset'] = now
-        logger.info(f"Hourly quota reset for user {user_id}")
+    if now >= quota.next_hourly_reset:
+        quota.hourly_count = 0
+        quota.next_hourly_reset = now + HOURLY_WINDOW_SECONDS
+        logger.info("Hourly quota reset for user %s", user_id)
+    
+    return quota
 
-def check_quota(user_id: int) -> tuple[bool, str]:
+def check_quota(user_id: int, now: Optional[float] = None) -> tuple[bool, str]:
     """
     Cek apakah user masih punya quota
     Returns: (can_proceed, message)
     """
-    reset_quota_if_needed(user_id)
+    if now is None:
+        now = time.monotonic()
+    quota = reset_quota_if_needed(user_id, now)
     
     # Premium user unlimited
-    if user_quota[user_id]['is_premium']:
+    if quota.is_premium:
         return True, ""
     
     # Cek hourly limit
-    if user_quota[user_id]['hourly_count'] >= HOURLY_RATE_LIMIT:
-        wait_time = user_quota[user_id]['hourly_reset'] + timedelta(hours=1) - datetime.now()
-        minutes = int(wait_time.total_seconds() / 60)
+    if quota.hourly_count >= HOURLY_RATE_LIMIT:
+        minutes = int((quota.next_hourly_reset - now) / 60)
         return False, f"⏰ Rate limit tercapai! Tunggu {minutes} menit lagi.\n\n💎 Upgrade ke Premium untuk unlimited access!"
     
     # Cek daily quota
-    if user_quota[user_id]['daily_count'] >= FREE_DAILY_QUOTA:
+    if quota.daily_count >= FREE_DAILY_QUOTA:
         return False, f"📊 Quota harian habis ({FREE_DAILY_QUOTA}/{FREE_DAILY_QUOTA})!\n\n💎 Upgrade ke Premium untuk unlimited quota!"
     
     return True, ""
 
 def increment_quota(user_id: int):
     """Increment quota setelah generate"""
-    user_quota[user_id]['daily_count'] += 1
-    user_quota[user_id]['hourly_count'] += 1
+    quota = user_quota[user_id]
+    quota.daily_count += 1
+    quota.hourly_count += 1
 
-def get_quota_status(user_id: int) -> str:
+@functools.lru_cache(maxsize=256)
+def format_quota_status(daily_count: int, hourly_count: int) -> str:
+    """Render status quota free user; hanya bergantung pada counter jadi aman di-memoize"""
+    return QUOTA_STATUS_TEXT.format(
+        daily=daily_count,
+        daily_remaining=FREE_DAILY_QUOTA - daily_count,
+        hourly=hourly_count,
+        hourly_remaining=HOURLY_RATE_LIMIT - hourly_count
+    )
+
+def get_quota_status(user_id: int, now: Optional[float] = None) -> str:
     """Get status quota user"""
-    reset_quota_if_needed(user_id)
-    
-    if user_quota[user_id]['is_premium']:
-        return "💎 Status: Premium (Unlimited)\n✨ Tidak ada batasan quota!"
+    quota = reset_quota_if_needed(user_id, now)
     
-    daily_remaining = FREE_DAILY_QUOTA - user_quota[user_id]['daily_count']
-    hourly_remaining = HOURLY_RATE_LIMIT - user_quota[user_id]['hourly_count']
+    if quota.is_premium:
+        return PREMIUM_QUOTA_TEXT
     
-    return (
-        f"📊 Quota Status:\n"
-        f"├─ Harian: {user_quota[user_id]['daily_count']}/{FREE_DAILY_QUOTA} (sisa {daily_remaining})\n"
-        f"├─ Per Jam: {user_quota[user_id]['hourly_count']}/{HOURLY_RATE_LIMIT} (sisa {hourly_remaining})\n"
-        f"└─ Status: Free User\n\n"
-        f"💡 Tip: Gunakan /premium untuk upgrade!"
-    )
+    return format_quota_status(quota.daily_count, quota.hourly_count)
 
 # ==================== PAYMENT (PSEUDO) ====================
 
@@ -236,7 +784,7 @@ async def process_payment_pseudo(user_id: int, payment_method: str, amount: floa
     Di production, ini akan integrate dengan payment gateway
     """
     # Simulasi payment processing
-    logger.info(f"Processing payment for user {user_id}: {payment_method} - ${amount}")
+    logger.info("Processing payment for user %s: %s - $%s", user_id, payment_method, amount)
     
     # Untuk testing, selalu return success
     # Di production, ini akan hit payment gateway API
@@ -245,108 +793,256 @@ async def process_payment_pseudo(user_id: int, payment_method: str, amount: floa
     
     if success:
         # Activate premium
-        init_user_quota(user_id)
-        user_quota[user_id]['is_premium'] = True
+        init_user_quota(user_id).is_premium = True
         return True, f"✅ Pembayaran berhasil!\n🎫 Transaction ID: {transaction_id}"
     else:
         return False, "❌ Pembayaran gagal. Silakan coba lagi."
 
 # ==================== PDF SERVICE API ====================
 
-def fetch_markdown_from_url(url: str) -> Optional[str]:
-    """Fetch markdown dari URL (GitHub, raw file, etc)"""
+# HTTP client bersama (keep-alive), dibuat di post_init dan ditutup di post_stop
+http_client: Optional[httpx.AsyncClient] = None
+
+try:
+    import h2  # noqa: F401 - HTTP/2 untuk host HTTPS (GitHub/GitLab); PDF service tetap HTTP/1.1
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+def create_http_client() -> httpx.AsyncClient:
+    """Buat HTTP client async untuk PDF service dan fetch URL"""
+    # retries hanya mengulang kegagalan connect, jadi aman untuk body yang di-stream
+    transport = httpx.AsyncHTTPTransport(
+        http2=HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE
+        ),
+        retries=HTTP_CONNECT_RETRIES
+    )
+    return httpx.AsyncClient(
+        timeout=30,
+        follow_redirects=True,
+        transport=transport
+    )
+
+async def fetch_markdown_from_url(url: str) -> Optional[str]:
+    """
+    Fetch markdown dari URL (GitHub, raw file, etc)
+    Revalidasi dengan ETag/Last-Modified; 304 memakai isi dari url_cache
+    """
+    # URL ber-query bisa membawa token akses, jangan di-cache
+    cacheable = '?' not in url
+    cached = url_cache.get(url) if cacheable else None
+    headers = {}
+    if cached:
+        etag, last_modified, _ = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    
     try:
-        response = requests.get(url, timeout=10)
+        response = await http_client.get(url, headers=headers, timeout=10)
+        if cached and response.status_code == 304:
+            logger.info("♻️ URL not modified, using cached content: %s", url)
+            return cached[2]
         response.raise_for_status()
-        return response.text
+        
+        text = response.text
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if cacheable and (etag or last_modified):
+            try:
+                url_cache[url] = (etag, last_modified, text)
+            except ValueError:
+                pass  # lebih besar dari kapasitas cache
+        return text
     except Exception as e:
-        logger.error(f"Error fetching URL: {e}")
+        logger.error("Error fetching URL: %s", e)
         return None
 
-def convert_markdown_to_pdf_via_api(markdown_content: str, output_path: str) -> tuple[bool, str]:
+PDF_TOO_LARGE_ERROR = f"PDF melebihi batas {MAX_PDF_MB}MB"
+
+async def convert_markdown_to_pdf_via_api(buf: UserSession) -> tuple[bool, str, Optional[bytes]]:
     """
-    Kirim markdown ke PDF service dan save hasilnya
-    Returns: (success, error_message)
+    Stream markdown (UTF-8) dari buffer sesi ke PDF service dan ambil hasilnya di memory
+    Returns: (success, error_message, pdf_bytes)
     """
     try:
-        logger.info(f"Sending markdown to PDF service: {PDF_SERVICE_URL}")
+        logger.info("Sending markdown to PDF service: %s", PDF_SERVICE_URL)
         
-        response = requests.post(
+        async with http_client.stream(
+            'POST',
             PDF_SERVICE_URL,
-            headers={'Content-Type': 'text/plain'},
-            data=markdown_content.encode('utf-8'),
+            # Content-Length eksplisit supaya body tidak dikirim chunked
+            headers={'Content-Type': 'text/plain', 'Content-Length': str(buf.total_bytes)},
+            content=buf.iter_bytes(buf.total_bytes),
             timeout=30
-        )
-        
-        response.raise_for_status()
-        
-        # Save PDF
-        with open(output_path, 'wb') as f:
-            f.write(response.content)
+        ) as response:
+            response.raise_for_status()
+            
+            # Tolak PDF yang melebihi batas upload Telegram sebelum dibaca penuh
+            if int(response.headers.get('Content-Length', 0)) > MAX_PDF_BYTES:
+                return False, PDF_TOO_LARGE_ERROR, None
+            
+            chunks = []
+            received = 0
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                received += len(chunk)
+                if received > MAX_PDF_BYTES:
+                    return False, PDF_TOO_LARGE_ERROR, None
+                chunks.append(chunk)
         
-        logger.info(f"PDF saved successfully: {output_path}")
-        return True, ""
+        logger.info("PDF received successfully: %d bytes", received)
+        return True, "", b"".join(chunks)
         
-    except requests.exceptions.Timeout:
-        return False, "Timeout: PDF service tidak merespon"
-    except requests.exceptions.ConnectionError:
-        return False, "Connection Error: Tidak dapat terhubung ke PDF service"
-    except requests.exceptions.HTTPError as e:
-        return False, f"HTTP Error: {e.response.status_code}"
+    except httpx.TimeoutException:
+        return False, "Timeout: PDF service tidak merespon", None
+    except httpx.NetworkError:
+        return False, "Connection Error: Tidak dapat terhubung ke PDF service", None
+    except httpx.HTTPStatusError as e:
+        return False, f"HTTP Error: {e.response.status_code}", None
     except Exception as e:
-        logger.error(f"Error converting to PDF: {e}", exc_info=True)
-        return False, str(e)
+        logger.error("Error converting to PDF: %s", e, exc_info=True)
+        return False, str(e), None
+
+# ==================== PESAN ====================
+
+WELCOME_TEXT = (
+    "🎨 Selamat datang di Markdown to PDF Bot!\n\n"
+    "📥 Cara Pakai:\n"
+    "├─ Kirim teks Markdown langsung\n"
+    "├─ Kirim file .md atau .txt\n"
+    "├─ Kirim link GitHub (raw markdown)\n"
+    "└─ Gunakan /convert untuk buat PDF\n\n"
+    "⚡ Commands:\n"
+    "├─ /status - Cek markdown & quota\n"
+    "├─ /quota - Lihat quota detail\n"
+    "├─ /premium - Upgrade ke Premium\n"
+    "└─ /cancel - Batalkan proses\n\n"
+)
+WELCOME_GUIDE_TEXT = (
+    "👋 **Halo! Mari mulai konversi Markdown ke PDF**\n\n"
+
+    "📖 **Panduan Singkat:**\n"
+    "1. **Ketik** /start untuk memulai\n"
+    "2. **Kirim** konten Markdown dengan cara:\n"
+    "   • 📝 **Teks langsung** - ketik markdown\n"
+    "   • 📎 **File** - upload file .md/.txt\n"
+    "   • 🔗 **URL** - link GitHub/GitLab\n"
+    "3. **Konversi** dengan /convert\n\n"
+
+    "⚡ **Contoh penggunaan:**\n"
+    "/start → kirim teks markdown → /convert\n\n"
+
+    "🎯 **Fitur unggulan:**\n"
+    "• ✅ Support GitHub/GitLab URLs\n"
+    "• 📊 Multiple konten dalam 1 PDF\n"
+    "• 🎨 Formatting lengkap\n"
+    "• 🔒 Privasi terjamin\n\n"
+
+    "**Ketik /start sekarang untuk memulai!** 🚀"
+)
+CANCEL_TEXT = "❌ Proses dibatalkan. Gunakan /start untuk memulai lagi."
+ADMIN_ONLY_TEXT = "⛔ Command ini hanya untuk admin."
+NO_SESSION_CONVERT_TEXT = "Tidak ada markdown untuk dikonversi. Gunakan /start untuk memulai."
+EMPTY_BUFFER_TEXT = "Anda belum mengirim markdown apapun. Kirim teks/file markdown terlebih dahulu."
+NO_MARKDOWN_STATUS_TEXT = "Belum ada markdown yang dikirim. Gunakan /start untuk memulai."
+NO_SESSION_DOCUMENT_TEXT = "Gunakan /start untuk memulai konversi Markdown ke PDF."
+UNSUPPORTED_FILE_TEXT = "❌ Hanya file .md atau .txt yang didukung!"
+MARKDOWN_TOO_LARGE_TEXT = (
+    f"❌ Total markdown melebihi batas {MAX_MARKDOWN_MB} MB per sesi.\n\n"
+    "Gunakan /convert untuk konten yang sudah dikirim, atau /cancel untuk mulai ulang."
+)
+
+# Template pesan: bagian konstan (limit, path) sudah diisi saat import,
+# handler hanya mengisi placeholder {...} dengan str.format
+PREMIUM_QUOTA_TEXT = "💎 Status: Premium (Unlimited)\n✨ Tidak ada batasan quota!"
+QUOTA_STATUS_TEXT = (
+    "📊 Quota Status:\n"
+    "├─ Harian: {daily}/" f"{FREE_DAILY_QUOTA}" " (sisa {daily_remaining})\n"
+    "├─ Per Jam: {hourly}/" f"{HOURLY_RATE_LIMIT}" " (sisa {hourly_remaining})\n"
+    "└─ Status: Free User\n\n"
+    "💡 Tip: Gunakan /premium untuk upgrade!"
+)
+STATUS_TEXT = (
+    "📊 Status Markdown:\n"
+    "├─ Total input: {count}\n"
+    "└─ Total karakter: {total_chars}\n\n"
+    "📄 Preview:\n{preview}\n\n"
+    "{quota_info}\n\n"
+    "Gunakan /convert untuk buat PDF atau /cancel untuk batal."
+)
+ADMIN_STATS_TEXT = (
+    "📊 **Log Database Statistics**\n\n"
+    f"📁 File: `{os.path.basename(LOG_CSV_FILE)}`\n"
+    f"📍 Path: `{LOG_CSV_ABS}`\n"
+    "💾 Size: {file_size_mb:.2f} MB\n\n"
+    "📈 Records:\n"
+    "├─ Total: {total_records}\n"
+    "├─ Successful: {successful_conversions}\n"
+    "└─ Failed: {failed_conversions}\n\n"
+    "👥 Users:\n"
+    "├─ Total: {total_users}\n"
+    "└─ Premium: {premium_users}\n\n"
+    f"💾 Backup Dir: `{BACKUP_DIR_ABS}`"
+)
+EMPTY_STATS = {
+    'file_size_mb': 0,
+    'total_records': 0,
+    'successful_conversions': 0,
+    'failed_conversions': 0,
+    'total_users': 0,
+    'premium_users': 0
+}
+URL_FETCHED_TEXT = (
+    "✅ **Berhasil mengambil konten dari URL!**\n\n"
+    "📊 **Detail:**\n"
+    "• 📏 Panjang: {length:,} karakter\n"
+    "• 📑 Baris: {lines}\n"
+    "• 💾 Ukuran: {size_kb:.1f} KB\n\n"
+    "**Langkah selanjutnya:**\n"
+    "• Kirim lebih banyak konten, atau\n"
+    "• Gunakan /convert untuk buat PDF\n"
+    "• Cek /status untuk melihat semua konten"
+)
 
 # ==================== TELEGRAM HANDLERS ====================
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /start"""
     user_id = update.effective_user.id
-    user_states[user_id] = 'waiting_input'
-    user_markdown[user_id] = []
+    # Sesi lama dibuang; konfirmasi yang masih tertunda jangan sampai terkirim
+    old_buf = user_sessions.pop(user_id, None)
+    if old_buf is not None:
+        cancel_pending_ack(old_buf)
+    user_sessions[user_id] = UserSession()
     init_user_quota(user_id)
     
-    quota_status = get_quota_status(user_id)
+    quota_status = get_quota_status(user_id, context.received_at)
     
-    await update.message.reply_text(
-        "🎨 Selamat datang di Markdown to PDF Bot!\n\n"
-        "📥 Cara Pakai:\n"
-        "├─ Kirim teks Markdown langsung\n"
-        "├─ Kirim file .md atau .txt\n"
-        "├─ Kirim link GitHub (raw markdown)\n"
-        "└─ Gunakan /convert untuk buat PDF\n\n"
-        "⚡ Commands:\n"
-        "├─ /status - Cek markdown & quota\n"
-        "├─ /quota - Lihat quota detail\n"
-        "├─ /premium - Upgrade ke Premium\n"
-        "└─ /cancel - Batalkan proses\n\n"
-        f"{quota_status}"
-    )
+    await update.message.reply_text(WELCOME_TEXT + quota_status)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /cancel"""
     user_id = update.effective_user.id
-    if user_id in user_states:
-        del user_states[user_id]
-    if user_id in user_markdown:
-        del user_markdown[user_id]
+    buf = user_sessions.pop(user_id, None)
+    if buf is not None:
+        cancel_pending_ack(buf)
     
-    await update.message.reply_text(
-        "❌ Proses dibatalkan. Gunakan /start untuk memulai lagi."
-    )
+    await update.message.reply_text(CANCEL_TEXT)
 
 async def quota_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /quota"""
     user_id = update.effective_user.id
-    status = get_quota_status(user_id)
+    status = get_quota_status(user_id, context.received_at)
     await update.message.reply_text(status)
 
 async def premium_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /premium"""
     user_id = update.effective_user.id
-    init_user_quota(user_id)
-    
-    if user_quota[user_id]['is_premium']:
+    if init_user_quota(user_id).is_premium:
         await update.message.reply_text(
             "💎 Anda sudah Premium!\n\n"
             "✨ Benefit Premium:\n"
@@ -399,36 +1095,26 @@ async def activate_premium(update: Update, context: ContextTypes.DEFAULT_TYPE):
     #     await update.message.reply_text(message)
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handler untuk command /stats - statistik Excel (admin only)"""
+    """Handler untuk command /stats - statistik log generasi (admin only)"""
     # Simple admin check - bisa diganti dengan list admin user_id
-    ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_USER_IDS', '896847229').split(',') if x]
     
     if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS:
-        await update.message.reply_text("⛔ Command ini hanya untuk admin.")
+        await update.message.reply_text(ADMIN_ONLY_TEXT)
         return
     
     stats = get_excel_stats()
     
     await update.message.reply_text(
-        f"📊 **Excel Database Statistics**\n\n"
-        f"📁 File: `{os.path.basename(EXCEL_LOG_FILE)}`\n"
-        f"📍 Path: `{os.path.abspath(EXCEL_LOG_FILE)}`\n"
-        f"💾 Size: {stats.get('file_size_mb', 0):.2f} MB\n\n"
-        f"📈 Records:\n"
-        f"├─ Total: {stats.get('total_records', 0)}\n"
-        f"├─ Successful: {stats.get('successful_conversions', 0)}\n"
-        f"└─ Failed: {stats.get('failed_conversions', 0)}\n\n"
-        f"👥 Users:\n"
-        f"├─ Total: {stats.get('total_users', 0)}\n"
-        f"└─ Premium: {stats.get('premium_users', 0)}\n\n"
-        f"💾 Backup Dir: `{os.path.abspath(BACKUP_DIR)}`",
+        ADMIN_STATS_TEXT.format_map({**EMPTY_STATS, **stats}),
         parse_mode='Markdown'
     )
 
+# Tabel escape MarkdownV2: setiap karakter spesial (termasuk backslash) diberi prefix backslash
+_MDV2_ESCAPE_TABLE = str.maketrans({c: '\\' + c for c in '_*[]()~`>#+-=|{}.!\\'})
+
 def escape_markdown_v2(text: str) -> str:
     # Escape semua karakter spesial di MarkdownV2
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text or "")
+    return (text or "").translate(_MDV2_ESCAPE_TABLE)
 
 async def my_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -452,15 +1138,14 @@ async def my_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def admin_backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /backup - manual backup (admin only)"""
-    ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_USER_IDS', '').split(',') if x]
     
     if ADMIN_IDS and update.effective_user.id not in ADMIN_IDS:
-        await update.message.reply_text("⛔ Command ini hanya untuk admin.")
+        await update.message.reply_text(ADMIN_ONLY_TEXT)
         return
     
     msg = await update.message.reply_text("⏳ Creating backup...")
     
-    backup_path = backup_excel()
+    backup_path = await asyncio.to_thread(backup_excel)
     
     if backup_path:
         # Kirim file backup
@@ -480,50 +1165,63 @@ async def convert_to_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     # Cek state
-    if user_id not in user_states or user_id not in user_markdown:
-        await update.message.reply_text(
-            "Tidak ada markdown untuk dikonversi. Gunakan /start untuk memulai."
-        )
+    buf = user_sessions.get(user_id)
+    if buf is None:
+        await update.message.reply_text(NO_SESSION_CONVERT_TEXT)
         return
     
-    if not user_markdown[user_id]:
-        await update.message.reply_text(
-            "Anda belum mengirim markdown apapun. Kirim teks/file markdown terlebih dahulu."
-        )
+    if not buf.count:
+        await update.message.reply_text(EMPTY_BUFFER_TEXT)
         return
     
+    # Konfirmasi yang masih tertunda tidak relevan lagi
+    cancel_pending_ack(buf)
+    
     # Cek quota
-    can_proceed, quota_message = check_quota(user_id)
+    can_proceed, quota_message = check_quota(user_id, context.received_at)
     if not can_proceed:
         await update.message.reply_text(quota_message)
         return
     
-    # Gabungkan semua markdown
-    full_markdown = "\n\n".join(user_markdown[user_id])
+    # Cek cache PDF berdasarkan hash konten
+    # file_id Telegram dicek dulu supaya PDF yang sama tidak perlu di-upload ulang
+    cache_key = buf.cache_key()
+    file_id = pdf_file_ids.get(cache_key)
+    pdf_bytes = pdf_cache.get(cache_key) if file_id is None else None
     
-    # Loading message
-    loading_msg = await update.message.reply_text("⏳ Mengirim ke PDF service...")
+    # Loading message (beri tahu user jika harus antri)
+    queued = file_id is None and pdf_bytes is None and pdf_semaphore.locked()
+    loading_msg = await update.message.reply_text(
+        "⏳ Antrian konversi penuh, menunggu giliran..." if queued else "⏳ Mengirim ke PDF service..."
+    )
     
-    pdf_path = None
     success = False
     error_message = ""
     
     try:
-        # Buat temp file untuk PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as pdf_file:
-            pdf_path = pdf_file.name
-        
-        # Convert via API
-        success, error_message = convert_markdown_to_pdf_via_api(full_markdown, pdf_path)
+        if file_id is not None or pdf_bytes is not None:
+            logger.info("♻️ PDF cache hit for user %s", user_id)
+            success = True
+        else:
+            # Convert via API
+            async with pdf_semaphore:
+                if queued:
+                    await loading_msg.edit_text("⏳ Mengirim ke PDF service...")
+                success, error_message, pdf_bytes = await convert_markdown_to_pdf_via_api(buf)
+            
+            if success:
+                if len(pdf_bytes) <= pdf_cache.maxsize:
+                    pdf_cache[cache_key] = pdf_bytes
         
         if success:
             # Kirim PDF
-            with open(pdf_path, 'rb') as pdf:
-                await update.message.reply_document(
-                    document=pdf,
-                    filename='markdown_converted.pdf',
-                    caption=f"✅ Konversi berhasil!\n📄 Input: {len(user_markdown[user_id])} pesan"
-                )
+            sent = await update.message.reply_document(
+                document=file_id if file_id is not None else io.BytesIO(pdf_bytes),
+                filename='markdown_converted.pdf',
+                caption=f"✅ Konversi berhasil!\n📄 Input: {buf.count} pesan"
+            )
+            if sent.document is not None:
+                pdf_file_ids[cache_key] = sent.document.file_id
             
             # Increment quota
             increment_quota(user_id)
@@ -537,8 +1235,7 @@ async def convert_to_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Reset state
-            del user_states[user_id]
-            del user_markdown[user_id]
+            user_sessions.pop(user_id, None)
         else:
             await loading_msg.edit_text(
                 f"❌ Gagal konversi ke PDF:\n{error_message}\n\n"
@@ -546,8 +1243,10 @@ async def convert_to_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         
     except Exception as e:
-        logger.error(f"Error in convert_to_pdf: {e}", exc_info=True)
+        logger.error("Error in convert_to_pdf: %s", e, exc_info=True)
         error_message = str(e)
+        # file_id bisa jadi sudah tidak valid, upload ulang di percobaan berikutnya
+        pdf_file_ids.pop(cache_key, None)
         await update.message.reply_text(
             f"❌ Terjadi kesalahan:\n{error_message}\n\nGunakan /start untuk mencoba lagi."
         )
@@ -559,55 +1258,61 @@ async def convert_to_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
             username=user.username,
             first_name=user.first_name,
             last_name=user.last_name,
-            input_type=message_types.get(user_id, 'unknown'),
-            input_length=len(full_markdown),
+            input_type=buf.msg_type,
+            input_length=buf.joined_length(),
             success=success,
             error_message=error_message,
-            is_premium=user_quota.get(user_id, {}).get('is_premium', False)
+            is_premium=user_id in user_quota and user_quota[user_id].is_premium
         )
-        
-        # Cleanup temp file
-        if pdf_path and os.path.exists(pdf_path):
-            try:
-                os.unlink(pdf_path)
-            except Exception as e:
-                logger.error(f"Error deleting temp file: {e}")
+
+def cancel_pending_ack(buf: UserSession):
+    """Batalkan konfirmasi markdown yang belum terkirim"""
+    if buf.ack_task is not None:
+        buf.ack_task.cancel()
+        buf.ack_task = None
+
+async def send_markdown_ack(update: Update, buf: UserSession):
+    """Kirim satu ringkasan setelah user berhenti mengirim pesan selama ACK_DEBOUNCE_SECONDS"""
+    await asyncio.sleep(ACK_DEBOUNCE_SECONDS)
+    buf.ack_task = None
+    
+    total = buf.count
+    total_chars = buf.total_chars
+    total_lines = buf.total_lines
+    
+    response_message = (
+        f"✅ **Konten ke-{total} berhasil disimpan!**\n\n"
+        f"📊 **Statistik terkini:**\n"
+        f"• 📝 Jumlah pesan: {total}\n"
+        f"• 📏 Total karakter: {total_chars:,}\n"
+        f"• 📑 Total baris: {total_lines}\n"
+        f"• 💾 Total ukuran: {total_chars / 1024:.1f} KB\n\n"
+        "**Apa selanjutnya?**\n"
+        "• ➕ Kirim lebih banyak konten\n"
+        "• 📄 Gunakan `/convert` untuk buat PDF\n"
+        "• 👀 Gunakan `/status` untuk review\n"
+        "• 🗑️  Gunakan `/cancel` untuk reset\n\n"
+        "**Tips:** Bisa kirim file .md, URL GitHub, atau teks markdown langsung!"
+    )
+    
+    await update.message.reply_text(
+        response_message,
+        reply_to_message_id=update.message.message_id
+    )
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk teks markdown"""
     user_id = update.effective_user.id
     
-    if user_id not in user_states or user_states[user_id] != 'waiting_input':
-        welcome_guide = (
-            "👋 **Halo! Mari mulai konversi Markdown ke PDF**\n\n"
-            
-            "📖 **Panduan Singkat:**\n"
-            "1. **Ketik** /start untuk memulai\n"
-            "2. **Kirim** konten Markdown dengan cara:\n"
-            "   • 📝 **Teks langsung** - ketik markdown\n"
-            "   • 📎 **File** - upload file .md/.txt\n"
-            "   • 🔗 **URL** - link GitHub/GitLab\n"
-            "3. **Konversi** dengan /convert\n\n"
-            
-            "⚡ **Contoh penggunaan:**\n"
-            "/start → kirim teks markdown → /convert\n\n"
-            
-            "🎯 **Fitur unggulan:**\n"
-            "• ✅ Support GitHub/GitLab URLs\n"
-            "• 📊 Multiple konten dalam 1 PDF\n"
-            "• 🎨 Formatting lengkap\n"
-            "• 🔒 Privasi terjamin\n\n"
-            
-            "**Ketik /start sekarang untuk memulai!** 🚀"
-        )
-        
-        await update.message.reply_text(welcome_guide, parse_mode='Markdown')
+    buf = user_sessions.get(user_id)
+    if buf is None:
+        await update.message.reply_text(WELCOME_GUIDE_TEXT, parse_mode='Markdown')
         return
     
     text = update.message.text
     
     # Cek apakah ini URL
-    if text.startswith('http://') or text.startswith('https://'):
+    if text.startswith(('http://', 'https://')):
         loading_msg = await update.message.reply_text(
             "🔗 **Mendeteksi URL...**\n"
             "⏳ Mengambil konten markdown..."
@@ -616,22 +1321,20 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Convert URL ke raw URL jika diperlukan
         raw_url = convert_to_raw_url(text)
         
-        markdown_content = fetch_markdown_from_url(raw_url)
+        markdown_content = await fetch_markdown_from_url(raw_url)
         
-        message_types[user_id] = 'url'
+        buf.msg_type = 'url'
         
-        if markdown_content:
-            user_markdown[user_id].append(markdown_content)
+        if markdown_content and not buf.append(markdown_content):
+            await loading_msg.edit_text(MARKDOWN_TOO_LARGE_TEXT)
+        elif markdown_content:
+            user_sessions[user_id] = buf  # perpanjang TTL sesi
             await loading_msg.edit_text(
-                "✅ **Berhasil mengambil konten dari URL!**\n\n"
-                f"📊 **Detail:**\n"
-                f"• 📏 Panjang: {len(markdown_content):,} karakter\n"
-                f"• 📑 Baris: {markdown_content.count(chr(10)) + 1}\n"
-                f"• 💾 Ukuran: {len(markdown_content.encode('utf-8')) / 1024:.1f} KB\n\n"
-                "**Langkah selanjutnya:**\n"
-                "• Kirim lebih banyak konten, atau\n"
-                "• Gunakan /convert untuk buat PDF\n"
-                "• Cek /status untuk melihat semua konten",
+                URL_FETCHED_TEXT.format(
+                    length=len(markdown_content),
+                    lines=markdown_content.count('\n') + 1,
+                    size_kb=len(markdown_content.encode('utf-8')) / 1024
+                ),
                 parse_mode='Markdown'
             )
         else:
@@ -650,38 +1353,50 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
     else:
         # Teks biasa
-        if user_id not in user_markdown:
-            user_markdown[user_id] = []
-        
-        user_markdown[user_id].append(text)
-        message_types[user_id] = 'text'
-        total = len(user_markdown[user_id])
+        if not buf.append(text):
+            await update.message.reply_text(MARKDOWN_TOO_LARGE_TEXT)
+            return
+        user_sessions[user_id] = buf  # perpanjang TTL sesi
+        buf.msg_type = 'text'
         
-        # Hitung statistik
-        total_chars = sum(len(content) for content in user_markdown[user_id])
-        total_lines = sum(content.count(chr(10)) + 1 for content in user_markdown[user_id])
-        
-        response_message = (
-            f"✅ **Konten ke-{total} berhasil disimpan!**\n\n"
-            f"📊 **Statistik terkini:**\n"
-            f"• 📝 Jumlah pesan: {total}\n"
-            f"• 📏 Total karakter: {total_chars:,}\n"
-            f"• 📑 Total baris: {total_lines}\n"
-            f"• 💾 Total ukuran: {total_chars / 1024:.1f} KB\n\n"
-            "**Apa selanjutnya?**\n"
-            "• ➕ Kirim lebih banyak konten\n"
-            "• 📄 Gunakan `/convert` untuk buat PDF\n"
-            "• 👀 Gunakan `/status` untuk review\n"
-            "• 🗑️  Gunakan `/cancel` untuk reset\n\n"
-            "**Tips:** Bisa kirim file .md, URL GitHub, atau teks markdown langsung!"
-        )
-        
-        await update.message.reply_text(
-            response_message,
-            reply_to_message_id=update.message.message_id
+        # Gabungkan konfirmasi untuk burst pesan (misal teks panjang yang terpecah)
+        cancel_pending_ack(buf)
+        buf.ack_task = context.application.create_task(
+            send_markdown_ack(update, buf), update=update
         )
 
 
+def _bitbucket_raw_url(url: str) -> str:
+    """Bitbucket URL -> raw URL (satu-satunya kasus yang perlu memecah path)"""
+    parsed = urlsplit(url)
+    # Ganti /src/ dengan /raw/ dan tambahkan parameter ?at=default jika perlu
+    path_parts = parsed.path.split('/')
+    if 'src' not in path_parts:
+        return url
+    if len(path_parts) > 4:
+        # Format: /workspace/repo/src/branch/path -> /workspace/repo/raw/branch/path
+        src_index = path_parts.index('src')
+        if src_index != -1 and len(path_parts) > src_index + 1:
+            path_parts[src_index] = 'raw'
+            new_path = '/'.join(path_parts)
+            return f'{parsed.scheme}://{parsed.hostname}{new_path}'
+    return url
+
+# (prefix origin, penanda path wajib, konversi) - dicek berurutan dengan startswith
+_RAW_URL_RULES = (
+    # GitHub blob URL -> raw URL
+    (('https://github.com/', 'http://github.com/'), '/blob/',
+     lambda u: u.replace('github.com', 'raw.githubusercontent.com').replace('/blob/', '/')),
+    # GitHub gist URL: hapus trailing slash jika ada dan tambahkan /raw
+    (('https://gist.github.com/', 'http://gist.github.com/'), None,
+     lambda u: f"{u.rstrip('/')}/raw"),
+    # GitLab blob URL -> raw URL
+    (('https://gitlab.com/', 'http://gitlab.com/'), '/blob/',
+     lambda u: u.replace('/blob/', '/raw/')),
+    # Bitbucket URL -> raw URL
+    (('https://bitbucket.org/', 'http://bitbucket.org/'), '/src/', _bitbucket_raw_url),
+)
+
 def convert_to_raw_url(url: str) -> str:
     """
     Convert berbagai URL GitHub ke raw URL
@@ -692,35 +1407,12 @@ def convert_to_raw_url(url: str) -> str:
     Returns:
         URL raw untuk mengakses konten langsung
     """
-    from urllib.parse import urlparse
-    
-    parsed = urlparse(url)
-    
-    # GitHub blob URL -> raw URL
-    if parsed.hostname == 'github.com' and '/blob/' in parsed.path:
-        return url.replace('github.com', 'raw.githubusercontent.com').replace('/blob/', '/')
-    
-    # GitHub gist URL
-    if parsed.hostname == 'gist.github.com':
-        # Hapus trailing slash jika ada dan tambahkan /raw
-        gist_url = url.rstrip('/')
-        return f'{gist_url}/raw'
-    
-    # GitLab blob URL -> raw URL
-    if parsed.hostname == 'gitlab.com' and '/blob/' in parsed.path:
-        return url.replace('/blob/', '/raw/')
-    
-    # Bitbucket URL -> raw URL
-    if parsed.hostname == 'bitbucket.org' and '/src/' in parsed.path:
-        # Ganti /src/ dengan /raw/ dan tambahkan parameter ?at=default jika perlu
-        path_parts = parsed.path.split('/')
-        if len(path_parts) > 4:
-            # Format: /workspace/repo/src/branch/path -> /workspace/repo/raw/branch/path
-            src_index = path_parts.index('src')
-            if src_index != -1 and len(path_parts) > src_index + 1:
-                path_parts[src_index] = 'raw'
-                new_path = '/'.join(path_parts)
-                return f'{parsed.scheme}://{parsed.hostname}{new_path}'
+    for prefixes, marker, convert in _RAW_URL_RULES:
+        if url.startswith(prefixes):
+            # Penanda hanya dicek di path, bukan di query/fragment
+            if marker is None or marker in urlsplit(url).path:
+                return convert(url)
+            break
     
     return url
 
@@ -728,20 +1420,22 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk file .md atau .txt"""
     user_id = update.effective_user.id
     
-    if user_id not in user_states or user_states[user_id] != 'waiting_input':
-        await update.message.reply_text(
-            "Gunakan /start untuk memulai konversi Markdown ke PDF."
-        )
+    buf = user_sessions.get(user_id)
+    if buf is None:
+        await update.message.reply_text(NO_SESSION_DOCUMENT_TEXT)
         return
     
     document: Document = update.message.document
     file_name = document.file_name.lower()
     
     # Cek ekstensi file
-    if not (file_name.endswith('.md') or file_name.endswith('.txt')):
-        await update.message.reply_text(
-            "❌ Hanya file .md atau .txt yang didukung!"
-        )
+    if not file_name.endswith(('.md', '.txt')):
+        await update.message.reply_text(UNSUPPORTED_FILE_TEXT)
+        return
+    
+    # Tolak sebelum download jika file saja sudah melebihi batas sesi
+    if document.file_size and buf.total_bytes + document.file_size > MAX_MARKDOWN_BYTES:
+        await update.message.reply_text(MARKDOWN_TOO_LARGE_TEXT)
         return
     
     loading = await update.message.reply_text("⏳ Memproses file...")
@@ -750,21 +1444,16 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Download file
         file = await context.bot.get_file(document.file_id)
         
-        # Read content
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as temp_file:
-            await file.download_to_drive(temp_file.name)
-            
-            with open(temp_file.name, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            os.unlink(temp_file.name)
+        # Read content langsung di memory (tanpa temp file)
+        data = await file.download_as_bytearray()
+        content = data.decode('utf-8')
         
         # Simpan markdown
-        if user_id not in user_markdown:
-            user_markdown[user_id] = []
-        
-        user_markdown[user_id].append(content)
-        message_types[user_id] = 'file'
+        if not buf.append(content):
+            await loading.edit_text(MARKDOWN_TOO_LARGE_TEXT)
+            return
+        user_sessions[user_id] = buf  # perpanjang TTL sesi
+        buf.msg_type = 'file'
         await loading.edit_text(
             f"✅ File '{document.file_name}' berhasil diproses!\n"
             f"📏 Panjang: {len(content)} karakter\n\n"
@@ -772,37 +1461,136 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     except Exception as e:
-        logger.error(f"Error processing document: {e}", exc_info=True)
+        logger.error("Error processing document: %s", e, exc_info=True)
         await loading.edit_text(f"❌ Gagal memproses file: {str(e)}")
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handler untuk command /status"""
     user_id = update.effective_user.id
     
-    if user_id not in user_markdown or not user_markdown[user_id]:
-        await update.message.reply_text(
-            "Belum ada markdown yang dikirim. Gunakan /start untuk memulai."
-        )
+    buf = user_sessions.get(user_id)
+    if buf is None or not buf.count:
+        await update.message.reply_text(NO_MARKDOWN_STATUS_TEXT)
         return
     
-    total_messages = len(user_markdown[user_id])
-    total_chars = sum(len(msg) for msg in user_markdown[user_id])
-    
-    preview = user_markdown[user_id][0][:150]
-    if len(user_markdown[user_id][0]) > 150:
-        preview += "..."
-    
-    quota_info = get_quota_status(user_id)
-    
-    await update.message.reply_text(
-        f"📊 Status Markdown:\n"
-        f"├─ Total input: {total_messages}\n"
-        f"└─ Total karakter: {total_chars}\n\n"
-        f"📄 Preview:\n{preview}\n\n"
-        f"{quota_info}\n\n"
-        f"Gunakan /convert untuk buat PDF atau /cancel untuk batal."
+    await update.message.reply_text(STATUS_TEXT.format(
+        count=buf.count,
+        total_chars=buf.total_chars,
+        preview=buf.first_preview,
+        quota_info=get_quota_status(user_id, context.received_at)
+    ))
+
+class TelegramRequest(HTTPXRequest):
+    """HTTPXRequest yang decode respons Bot API dengan orjson bila tersedia"""
+    __slots__ = ()
+    
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> dict:
+        try:
+            return _json_loads(payload)
+        except ValueError:
+            # Serahkan ke parser bawaan PTB (decode errors="replace", log, TelegramError)
+            return HTTPXRequest.parse_json_payload(payload)
+
+def create_telegram_request(connection_pool_size: int = 1) -> TelegramRequest:
+    """Request Bot API; HTTP/2 dipakai bila h2 terpasang"""
+    return TelegramRequest(
+        connection_pool_size=connection_pool_size,
+        http_version='2' if HTTP2_AVAILABLE else '1.1'
     )
 
+class ChatOrderedUpdateProcessor(SimpleUpdateProcessor):
+    """
+    Update dari chat berbeda tetap diproses bersamaan, tapi update dalam satu chat
+    diproses berurutan (mis. pesan markdown panjang yang terpecah jadi beberapa bubble)
+    
+    Update pertama sebuah chat memegang satu slot CONCURRENT_UPDATES dan ikut menjalankan
+    update berikutnya dari chat yang sama; update yang menyusul hanya dititipkan ke antrean
+    lalu langsung melepas slotnya, jadi satu chat yang ramai tidak menghabiskan slot chat lain
+    """
+    __slots__ = ('_chat_queues',)
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # {chat_id: antrean coroutine update} - ada selama chat tersebut sedang diproses
+        self._chat_queues: dict[int, deque] = {}
+    
+    async def do_process_update(self, update: object, coroutine) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        
+        pending = self._chat_queues.get(chat.id)
+        if pending is not None:
+            pending.append(coroutine)
+            return
+        
+        pending = self._chat_queues[chat.id] = deque([coroutine])
+        try:
+            while pending:
+                try:
+                    await pending.popleft()
+                except Exception:
+                    # Error handler sudah dipanggil di Application.process_update; jangan hentikan antrean
+                    logger.exception("❌ Error processing update for chat %s", chat.id)
+        finally:
+            del self._chat_queues[chat.id]
+            for leftover in pending:  # hanya tersisa jika task dibatalkan
+                leftover.close()
+
+async def stamp_update_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Catat waktu update diterima sekali (group -1), dipakai handler untuk cek quota"""
+    context.received_at = time.monotonic()
+
+async def post_init(application: Application):
+    """Mulai background task setelah aplikasi diinisialisasi (termasuk init file log)"""
+    global _log_worker_task, http_client
+    http_client = create_http_client()
+    _log_worker_task = asyncio.create_task(log_worker())
+
+async def post_stop(application: Application):
+    """
+    Hentikan background task dan flush log yang tersisa
+    Dipanggil setelah Application.stop() selesai memproses update yang sedang berjalan
+    (termasuk konversi PDF), jadi log dan HTTP client ditutup paling akhir
+    """
+    if _log_worker_task is not None:
+        log_queue.put_nowait(None)
+        await _log_worker_task
+    drain_log_queue()
+    close_log_file()
+    if http_client is not None:
+        await http_client.aclose()
+
+# Semua handler hanya memproses message (command, teks, dokumen)
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+DOCUMENT_FILTER = filters.Document.ALL
+TEXT_FILTER = filters.TEXT & ~filters.COMMAND
+
+# {command: handler} - semua command didaftarkan lewat satu CommandHandler di main()
+COMMAND_HANDLERS = {
+    "start": start,
+    "cancel": cancel,
+    "convert": convert_to_pdf,
+    "status": status,
+    "quota": quota_status,
+    "premium": premium_info,
+    "activate_premium": activate_premium,
+    "stats": admin_stats,
+    "backup": admin_backup,
+    "myid": my_id,
+}
+
+async def dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Teruskan command ke handler-nya; CommandHandler sudah memvalidasi nama & @username bot"""
+    message = update.message
+    # Nama diambil dari entity bot_command, sama seperti CommandHandler.check_update
+    # (teks seperti "/convert." atau "/start,hi" ikut cocok tapi tanda bacanya di luar entity)
+    command = message.text[1:message.entities[0].length].split('@', 1)[0].lower()
+    await COMMAND_HANDLERS[command](update, context)
+
 def main():
     """Main function"""
     token = os.getenv('TELEGRAM_BOT_TOKEN')
@@ -811,39 +1599,82 @@ def main():
         logger.error("TELEGRAM_BOT_TOKEN tidak ditemukan!")
         return
     
-    # Init Excel log
-    init_excel_log()
+    # Event loop berbasis libuv jika tersedia (fallback ke asyncio default)
+    try:
+        import uvloop
+        # run_polling/run_webhook memakai asyncio.get_event_loop(), jadi loop dipasang langsung
+        asyncio.set_event_loop(uvloop.new_event_loop())
+        logger.info("⚡ uvloop enabled")
+    except ImportError:
+        pass
     
     # Buat aplikasi
-    application = Application.builder().token(token).build()
+    application = (
+        Application.builder()
+        .token(token)
+        .request(create_telegram_request(TELEGRAM_POOL_SIZE))
+        .get_updates_request(create_telegram_request())
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .build()
+    )
     
     # Tambahkan handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("cancel", cancel))
-    application.add_handler(CommandHandler("convert", convert_to_pdf))
-    application.add_handler(CommandHandler("status", status))
-    application.add_handler(CommandHandler("quota", quota_status))
-    application.add_handler(CommandHandler("premium", premium_info))
-    application.add_handler(CommandHandler("activate_premium", activate_premium))
-    application.add_handler(CommandHandler("stats", admin_stats))
-    application.add_handler(CommandHandler("backup", admin_backup))
-    application.add_handler(CommandHandler("myid", my_id))
-    application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    
-    # Jalankan bot
-    logger.info("=" * 60)
-    logger.info("🤖 Bot started successfully!")
-    logger.info("=" * 60)
-    logger.info(f"📊 Excel Log: {os.path.abspath(EXCEL_LOG_FILE)}")
-    logger.info(f"💾 Backup Dir: {os.path.abspath(BACKUP_DIR)}")
-    logger.info(f"🔧 PDF Service: {PDF_SERVICE_URL}")
-    logger.info(f"📈 Daily Quota: {FREE_DAILY_QUOTA}")
-    logger.info(f"⏱️  Hourly Limit: {HOURLY_RATE_LIMIT}")
-    logger.info(f"💾 Auto Backup: {'ON' if AUTO_BACKUP_ENABLED else 'OFF'} (every {BACKUP_INTERVAL_HOURS}h)")
-    logger.info("=" * 60)
-    
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.add_handler(TypeHandler(Update, stamp_update_time), group=-1)
+    application.add_handlers(
+        [
+            CommandHandler(COMMAND_HANDLERS, dispatch_command),
+            MessageHandler(DOCUMENT_FILTER, handle_document),
+            MessageHandler(TEXT_FILTER, handle_text),
+        ]
+    )
+    
+    # Jalankan bot (banner ditulis dalam satu log record)
+    logger.info("\n".join((
+        "=" * 60,
+        "🤖 Bot started successfully!",
+        "=" * 60,
+        f"📊 Generation Log: {LOG_CSV_ABS}",
+        f"💾 Backup Dir: {BACKUP_DIR_ABS}",
+        f"🔧 PDF Service: {PDF_SERVICE_URL}",
+        f"🚦 PDF Concurrency: {PDF_CONCURRENCY} (updates: {CONCURRENT_UPDATES})",
+        f"📈 Daily Quota: {FREE_DAILY_QUOTA}",
+        f"⏱️  Hourly Limit: {HOURLY_RATE_LIMIT}",
+        f"💾 Auto Backup: {'ON' if AUTO_BACKUP_ENABLED else 'OFF'} (every {BACKUP_INTERVAL_HOURS}h)",
+        f"📡 Mode: {'Webhook (' + PUBLIC_URL + ')' if PUBLIC_URL else 'Polling'}",
+        "=" * 60,
+    )), extra={
+        'event': 'bot_started',
+        'log_file': LOG_CSV_ABS,
+        'backup_dir': BACKUP_DIR_ABS,
+        'pdf_service': PDF_SERVICE_URL,
+        'pdf_concurrency': PDF_CONCURRENCY,
+        'concurrent_updates': CONCURRENT_UPDATES,
+        'daily_quota': FREE_DAILY_QUOTA,
+        'hourly_limit': HOURLY_RATE_LIMIT,
+        'auto_backup': AUTO_BACKUP_ENABLED,
+        'mode': 'webhook' if PUBLIC_URL else 'polling',
+    })
+    
+    if PUBLIC_URL:
+        # Telegram push update langsung, tanpa long-poll getUpdates
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=WEBHOOK_PORT,
+            url_path=token,
+            webhook_url=f"{PUBLIC_URL}/{token}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
+    else:
+        application.run_polling(
+            allowed_updates=ALLOWED_UPDATES,
+            timeout=POLL_TIMEOUT,
+            poll_interval=POLL_INTERVAL,
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
 
 if __name__ == '__main__':
     main()
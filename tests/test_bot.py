@@ -0,0 +1,108 @@
+import os
+import sys
+import tempfile
+import unittest
+
+# bot.py membaca DATA_DIR saat import; arahkan ke direktori sementara
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='bot-test-'))
+os.environ.setdefault('AUTO_BACKUP_ENABLED', 'false')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+class ConvertToRawUrlTest(unittest.TestCase):
+    def test_blob_urls_are_rewritten(self):
+        self.assertEqual(
+            bot.convert_to_raw_url('https://github.com/user/repo/blob/main/README.md'),
+            'https://raw.githubusercontent.com/user/repo/main/README.md'
+        )
+        self.assertEqual(
+            bot.convert_to_raw_url('https://gitlab.com/group/repo/-/blob/main/doc.md'),
+            'https://gitlab.com/group/repo/-/raw/main/doc.md'
+        )
+        self.assertEqual(
+            bot.convert_to_raw_url('https://bitbucket.org/ws/repo/src/main/doc.md'),
+            'https://bitbucket.org/ws/repo/raw/main/doc.md'
+        )
+
+    def test_marker_in_query_or_fragment_is_ignored(self):
+        for url in (
+            'https://github.com/user/repo/issues/1?ref=/blob/',
+            'https://gitlab.com/group/repo/-/issues/1#/blob/',
+            'https://bitbucket.org/ws/repo/commits/abc#/src/',
+            'https://bitbucket.org/ws/repo/commits/abc?path=/src/x',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(bot.convert_to_raw_url(url), url)
+
+
+
+class FlushLogBatchTest(unittest.TestCase):
+    ROW = ('2026-01-01 10:00:00', 1, 'user', 'First', '', 'text', 3, True, '', False)
+
+    def setUp(self):
+        bot.init_excel_log()
+
+    def tearDown(self):
+        bot.close_log_file()
+
+    def test_write_error_closes_handle_and_drops_batch(self):
+        class FailingWriter:
+            def writerows(self, rows):
+                raise OSError('disk full')
+
+        bot._flush_log_batch([self.ROW])
+        fh = bot._log_fh
+        total = bot.log_stats.total_records
+        bot._log_writer = FailingWriter()
+
+        with self.assertLogs('bot', 'ERROR') as logs:
+            bot._flush_log_batch([self.ROW, self.ROW])
+
+        self.assertTrue(fh.closed)
+        self.assertIsNone(bot._log_fh)
+        self.assertEqual(bot.log_stats.total_records, total)
+        self.assertIn('2 row(s) dropped', logs.output[0])
+
+        # Batch berikutnya membuka ulang file
+        bot._flush_log_batch([self.ROW])
+        self.assertEqual(bot.log_stats.total_records, total + 1)
+
+
+class ExportLogTest(unittest.TestCase):
+    """Karakter kontrol di data user tidak boleh menggagalkan export xlsx mana pun"""
+    USER_ID = 4242
+
+    @classmethod
+    def setUpClass(cls):
+        bot.init_excel_log()
+        bot._flush_log_batch([(
+            '2026-01-01 10:00:00', cls.USER_ID, 'bad\x01name', 'First\x1b', '', 'text', 3, False,
+            'Timeout\x00 <&>', False
+        )])
+        bot.close_log_file()
+
+    def assert_export_clean(self, export):
+        from openpyxl import load_workbook
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'export.xlsx')
+            export(path)
+            rows = [row for row in load_workbook(path, read_only=True).active.values if row[1] == self.USER_ID]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0][2:4], ('badname', 'First'))
+        self.assertEqual(rows[0][8], 'Timeout <&>')
+
+    def test_openpyxl_export(self):
+        self.assert_export_clean(bot._export_with_openpyxl)
+
+    @unittest.skipUnless(bot.PYEXCELERATE_AVAILABLE, 'pyexcelerate not installed')
+    def test_pyexcelerate_export(self):
+        self.assert_export_clean(bot._export_with_pyexcelerate)
+
+    def test_raw_xml_export(self):
+        self.assert_export_clean(bot._export_raw_xlsx)
+
+if __name__ == '__main__':
+    unittest.main()